@@ -1,109 +1,324 @@
 # app.py - Insurance Charges Prediction (robust loader + debug)
+import hashlib
 import os
 import traceback
 
 import streamlit as st
+import numpy as np
 import pandas as pd
+from threadpoolctl import ThreadpoolController
 
 # Page config (call before other Streamlit calls that affect layout)
 st.set_page_config(page_title="Insurance Charges Prediction", layout="wide")
 
 # --- Optional: small debug toggle (uncheck in production) ---
+@st.cache_data(ttl=5)
+def cwd_listing():
+    """Sorted cwd contents, refreshed at most every few seconds."""
+    return sorted(os.listdir(os.getcwd()))
+
+
 show_debug = st.sidebar.checkbox("Show debug info", value=False)
 
 if show_debug:
     st.markdown("### DEBUG: runtime info")
     st.write("app __file__:", os.path.abspath(__file__))
     st.write("cwd:", os.getcwd())
-    st.write("files in cwd:", sorted(os.listdir(os.getcwd())))
+    st.write("files in cwd:", cwd_listing())
 
-# --- Model loading (try cloudpickle, fall back to joblib with clear errors) ---
+# --- Model loading (skops if exported, else joblib with cloudpickle fallback) ---
+SKOPS_FILENAME = "insurance_model.skops"
 MODEL_FILENAME = "insurance_model.pkl"
-model = None
+skops_path = os.path.join(os.getcwd(), SKOPS_FILENAME)
 model_path = os.path.join(os.getcwd(), MODEL_FILENAME)
 
-if not os.path.exists(model_path):
-    st.error(f"Model file not found: `{MODEL_FILENAME}`. Please upload it to the app folder.")
-    if show_debug:
-        st.stop()
-    else:
-        st.stop()
+# Non-sklearn types allowed in the skops export. Checked against
+# get_untrusted_types() for the committed XGBoost pipeline (skops 0.16); review
+# the notebook cell's output again before changing it. Other types are rejected.
+TRUSTED_TYPES = [
+    "xgboost.core.Booster",
+    "xgboost.sklearn.XGBRegressor",
+]
 
-# Try to load with cloudpickle (more robust across environments)
-try:
-    import cloudpickle
+if not os.path.exists(skops_path) and not os.path.exists(model_path):
+    st.error(f"Model file not found: `{SKOPS_FILENAME}` or `{MODEL_FILENAME}`. "
+             "Please upload one of them to the app folder.")
+    st.stop()
 
-    with open(model_path, "rb") as f:
-        model = cloudpickle.load(f)
-    if show_debug:
-        st.success("Model loaded with cloudpickle.")
-except Exception as e_cloud:
-    # If cloudpickle fails, try joblib as a fallback, but show traceback
-    st.warning("cloudpickle load failed, trying joblib.load as a fallback...")
-    if show_debug:
-        st.text("cloudpickle error:")
-        st.text(traceback.format_exc())
 
+def build_input_row(age, sex, bmi, children, smoker, region):
+    """One-row DataFrame with the SAME columns used in training."""
+    return pd.DataFrame({
+        "age": [age],
+        "sex": [sex],
+        "bmi": [bmi],
+        "children": [children],
+        "smoker": [smoker],
+        "region": [region]
+    })
+
+
+# Representative row used to warm up the loaded model / ONNX session
+WARM_UP_INPUTS = {
+    "age": 30,
+    "sex": "male",
+    "bmi": 25.0,
+    "children": 0,
+    "smoker": "no",
+    "region": "southwest"
+}
+
+
+def warm_up(model):
+    """Run one dummy prediction so the first user click doesn't pay the first-call cost."""
+    # A broken model still fails in the prediction handler below
+    try:
+        model.predict(build_input_row(**WARM_UP_INPUTS))
+    except Exception:
+        pass
+
+
+@st.cache_resource(max_entries=1)
+def load_skops_model(path, mtime):
+    """Load the skops export once per process.
+
+    skops rebuilds the pipeline from a restricted format instead of running
+    pickle opcodes, and refuses any type outside its defaults and ``TRUSTED_TYPES``.
+    """
+    import skops.io as sio
+
+    model = sio.load(path, trusted=TRUSTED_TYPES)
+    warm_up(model)
+    return model
+
+
+class ModelLoadError(Exception):
+    """Both pickle loaders failed; carries each loader's traceback text."""
+
+    def __init__(self, joblib_error, cloud_error):
+        super().__init__("Failed to load model using both joblib and cloudpickle.")
+        self.joblib_error = joblib_error
+        self.cloud_error = cloud_error
+
+
+@st.cache_resource(max_entries=1)
+def load_model(path, mtime):
+    """Load the pickled pipeline once per file version (joblib, then cloudpickle)."""
     try:
         import joblib
 
-        model = joblib.load(model_path)
+        model, loader_name, joblib_error = joblib.load(path, mmap_mode="r"), "joblib", None
+    except Exception:
+        joblib_error = traceback.format_exc()
+
+        # If joblib fails, try cloudpickle as a fallback
+        try:
+            import cloudpickle
+
+            with open(path, "rb") as f:
+                model, loader_name = cloudpickle.load(f), "cloudpickle"
+        except Exception as e_cloud:
+            cloud_error = traceback.format_exc()
+            raise ModelLoadError(joblib_error, cloud_error) from e_cloud
+
+    warm_up(model)
+    return model, loader_name, joblib_error
+
+
+model = None
+if os.path.exists(skops_path):
+    model_mtime = os.path.getmtime(skops_path)
+    try:
+        model = load_skops_model(skops_path, model_mtime)
+        model_source = skops_path
+    except Exception:
+        if not os.path.exists(model_path):
+            st.error(f"Failed to load `{SKOPS_FILENAME}` with skops. See details below.")
+            st.text(traceback.format_exc())
+            st.stop()
+        # Fall back to the pickled model, but show traceback in debug mode
+        st.warning(f"`{SKOPS_FILENAME}` could not be loaded, using `{MODEL_FILENAME}` instead.")
         if show_debug:
-            st.success("Model loaded with joblib.")
-    except Exception as e_joblib:
-        st.error("Failed to load model using both cloudpickle and joblib. See details below.")
-        st.text("cloudpickle error:")
-        st.text("".join(traceback.format_exception(None, e_cloud, e_cloud.__traceback__)))
+            st.text(traceback.format_exc())
+    else:
+        if show_debug:
+            st.success("Model loaded with skops.")
+
+if model is None:
+    model_mtime = os.path.getmtime(model_path)
+    model_source = model_path
+
+    try:
+        model, loader_name, joblib_error = load_model(model_path, model_mtime)
+    except ModelLoadError as e_load:
+        st.error("Failed to load model using both joblib and cloudpickle. See details below.")
         st.text("joblib error:")
-        st.text("".join(traceback.format_exception(None, e_joblib, e_joblib.__traceback__)))
+        st.text(e_load.joblib_error)
+        st.text("cloudpickle error:")
+        st.text(e_load.cloud_error)
         st.stop()
 
+    if joblib_error is not None:
+        # joblib failed, cloudpickle fallback succeeded; show traceback in debug mode
+        st.warning("joblib load failed, model loaded with cloudpickle as a fallback.")
+        if show_debug:
+            st.text("joblib error:")
+            st.text(joblib_error)
+    if show_debug:
+        st.success(f"Model loaded with {loader_name}.")
+
+# --- Optional ONNX Runtime session (exported from the notebook) ---
+ONNX_FILENAME = "insurance_model.onnx"
+onnx_path = os.path.join(os.getcwd(), ONNX_FILENAME)
+
+
+def build_onnx_feeds(age, sex, bmi, children, smoker, region):
+    """One [1, 1] tensor per input column, matching the exported initial_types."""
+    return {
+        "age": np.array([[age]], dtype=np.float32),
+        "sex": np.array([[sex]], dtype=object),
+        "bmi": np.array([[bmi]], dtype=np.float32),
+        "children": np.array([[children]], dtype=np.float32),
+        "smoker": np.array([[smoker]], dtype=object),
+        "region": np.array([[region]], dtype=object)
+    }
+
+
+@st.cache_data(max_entries=2)
+def file_sha256(path, mtime):
+    """SHA-256 of a model file, recomputed only when its mtime changes."""
+    with open(path, "rb") as f:
+        return hashlib.sha256(f.read()).hexdigest()
+
+
+@st.cache_resource(max_entries=1)
+def load_onnx_session(path, mtime):
+    """ONNX Runtime session for the exported pipeline, or None without onnxruntime."""
+    try:
+        import onnxruntime
+    except ImportError:
+        return None
+    # Single-row inference: one intra-op thread avoids waking a thread pool per call
+    options = onnxruntime.SessionOptions()
+    options.intra_op_num_threads = 1
+    session = onnxruntime.InferenceSession(path, sess_options=options,
+                                           providers=["CPUExecutionProvider"])
+
+    # Pay the first-run cost here, not on the user's first click. A session that
+    # can't run raises, so it isn't cached and the caller falls back
+    session.run(None, build_onnx_feeds(**WARM_UP_INPUTS))
+    return session
+
+
+onnx_session = None
+onnx_mtime = None
+if os.path.exists(onnx_path):
+    onnx_mtime = os.path.getmtime(onnx_path)
+    try:
+        session = load_onnx_session(onnx_path, onnx_mtime)
+    except Exception:
+        # Fall back to the loaded model, but show traceback in debug mode
+        st.warning("ONNX model could not be loaded, using the pickled model instead.")
+        if show_debug:
+            st.text(traceback.format_exc())
+    else:
+        if session is not None:
+            # The notebook records the hash of each model file it exported from
+            source_name = os.path.basename(model_source)
+            exported_from = session.get_modelmeta().custom_metadata_map.get(f"sha256:{source_name}")
+            if exported_from == file_sha256(model_source, model_mtime):
+                onnx_session = session
+            else:
+                # Don't serve a graph exported from a different model
+                st.warning(f"`{ONNX_FILENAME}` was not exported from the loaded `{source_name}` "
+                           "and is ignored. Re-export it from the notebook to use ONNX Runtime.")
+if show_debug and onnx_session is not None:
+    st.success("Predictions run with ONNX Runtime.")
+
+# Changes whenever either model file is replaced
+model_key = (model_mtime, onnx_mtime if onnx_session is not None else None)
+
 # --- App UI ---
 st.title("Insurance Charges Prediction")
 st.write("This app predicts medical insurance charges based on user details.")
 
 # -------- Inputs (match your features exactly) --------
-age = st.slider("Age", min_value=18, max_value=80, value=30, step=1)
-
-bmi = st.number_input("BMI", min_value=10.0, max_value=60.0, value=25.0, step=0.1)
-
-children = st.number_input(
-    "Number of Children", min_value=0, max_value=10, value=0, step=1
-)
-
-# These values MUST match those in your CSV (check df['sex'].unique())
-sex = st.selectbox("Sex", ["male", "female"])
-
-# These values MUST match df['smoker'].unique()
-smoker = st.selectbox("Smoker", ["yes", "no"])
-
-# These values MUST match df['region'].unique()
-region = st.selectbox(
-    "Region",
-    ["southwest", "southeast", "northwest", "northeast"]
-)
-
-# Create input DataFrame with SAME columns used in training
-input_data = pd.DataFrame({
-    "age": [age],
-    "sex": [sex],
-    "bmi": [bmi],
-    "children": [children],
-    "smoker": [smoker],
-    "region": [region]
-})
+# Inputs live in a form so widget changes do not rerun the app until submit
+with st.form("insurance_form"):
+    age = st.slider("Age", min_value=18, max_value=80, value=30, step=1)
+
+    bmi = st.number_input("BMI", min_value=10.0, max_value=60.0, value=25.0, step=0.1)
+
+    children = st.number_input(
+        "Number of Children", min_value=0, max_value=10, value=0, step=1
+    )
+
+    # These values MUST match those in your CSV (check df['sex'].unique())
+    sex = st.selectbox("Sex", ["male", "female"])
 
+    # These values MUST match df['smoker'].unique()
+    smoker = st.selectbox("Smoker", ["yes", "no"])
+
+    # These values MUST match df['region'].unique()
+    region = st.selectbox(
+        "Region",
+        ["southwest", "southeast", "northwest", "northeast"]
+    )
+
+    submitted = st.form_submit_button("Predict Insurance Charge")
+
+# Show the raw values; the DataFrame is only built when predicting
 st.subheader("Your Input")
-st.write(input_data)
+st.json({
+    "age": age,
+    "sex": sex,
+    "bmi": bmi,
+    "children": children,
+    "smoker": smoker,
+    "region": region
+})
 
 # -------- Prediction --------
-if st.button("Predict Insurance Charge"):
+@st.cache_resource
+def thread_controller():
+    """Scan the loaded native thread pools once per process.
+
+    Created on the first prediction, after unpickling has loaded the model's
+    BLAS/OpenMP libraries.
+    """
+    return ThreadpoolController()
+
+
+@st.cache_data(max_entries=1000)
+def cached_predict(model_key, age, sex, bmi, children, smoker, region):
+    """Predict the charge for one set of inputs, memoized per model version."""
+    if onnx_session is not None:
+        feeds = build_onnx_feeds(age, sex, bmi, children, smoker, region)
+        return float(onnx_session.run(None, feeds)[0][0, 0])
+
+    row = build_input_row(age, sex, bmi, children, smoker, region)
+    # A single row gains nothing from BLAS/OpenMP threads; skip the pool wake-up
+    with thread_controller().limit(limits=1):
+        return float(model.predict(row)[0])
+
+
+# Last-write-wins: only the newest input tuple runs a prediction; a submit
+# with the inputs already on screen re-renders the stored result instead
+input_key = (model_key, age, sex, bmi, children, smoker, region)
+st.session_state.setdefault("last_predicted_key", None)
+st.session_state.setdefault("last_prediction", None)
+
+if submitted and input_key != st.session_state.last_predicted_key:
     try:
-        prediction = model.predict(input_data)[0]
-        st.subheader("Predicted Insurance Charge")
-        st.success(f"${prediction:,.2f}")
-    except Exception as e:
+        st.session_state.last_prediction = cached_predict(*input_key)
+        st.session_state.last_predicted_key = input_key
+    except Exception:
+        st.session_state.last_predicted_key = None
         st.error("Prediction failed. See error details below.")
-        st.text("".join(traceback.format_exception(None, e, e.__traceback__)))
+        st.text(traceback.format_exc())
         if show_debug:
             st.stop()
+
+if st.session_state.last_predicted_key == input_key:
+    st.subheader("Predicted Insurance Charge")
+    st.success(f"${st.session_state.last_prediction:,.2f}")